@@ -0,0 +1,119 @@
+# Latence de queue des appels LLM avec et sans requêtes de couverture, contre le serveur
+# OpenRouter factice : 4 % des requêtes prennent une seconde de plus. Un second scénario
+# fait échouer le modèle principal pour vérifier le repli sur la chaîne de modèles.
+#
+# Usage : python benchmarks/bench_hedging.py [--requests 300] [--concurrency 8]
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+PORT = free_port()
+os.environ.update({
+    "OPENROUTER_API_URL": f"http://127.0.0.1:{PORT}/api/v1/chat/completions",
+    "OPENROUTER_API_KEYS": "bench-key-1,bench-key-2,bench-key-3",
+    "OPENROUTER_MODELS": "principal,secours",
+    "DATABASE_FILE": os.path.join(tempfile.mkdtemp(prefix="cringegpt-hedging-"), "bench.db"),
+    "CONVERSATION_BACKEND": "memory",
+    "LOG_LEVEL": os.environ.get("LOG_LEVEL", "ERROR"),
+})
+os.chdir(os.path.join(HERE, ".."))
+
+import main  # noqa: E402
+import stub_openrouter  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+BASE_DELAY = 0.05
+TAIL_RATE = 0.04
+TAIL_DELAY = 1.0
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def fresh_router(hedge):
+    router = main.ModelRouter(
+        main.OPENROUTER_MODELS, hedge, main.OPENROUTER_HEDGE_PERCENTILE, main.OPENROUTER_HEDGE_MIN_SAMPLES,
+        main.OPENROUTER_HEDGE_DEFAULT_DELAY, 0.05, main.OPENROUTER_MODEL_MIN_SUCCESS,
+    )
+    main.model_router = router
+    return router
+
+
+async def run_requests(count, concurrency):
+    conv = main.Conversation("bench", main.get_system_message())
+    conv.append("user", "t'es qui ?")
+    payload = main.chat_payload.build(conv)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    answered = 0
+
+    async def one():
+        nonlocal answered
+        async with semaphore:
+            started = time.perf_counter()
+            data = await main.model_router.complete(payload)
+            latencies.append(time.perf_counter() - started)
+            answered += main.extract_answer(data) is not None
+
+    await asyncio.gather(*(one() for _ in range(count)))
+    return latencies, answered
+
+
+async def scenario(name, app_options, hedge, count, concurrency):
+    app = stub_openrouter.make_app(**app_options)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    try:
+        router = fresh_router(hedge)
+        await run_requests(50, concurrency)  # apprentissage des latences
+        requests_before = app["stats"]["requests"]
+        latencies, answered = await run_requests(count, concurrency)
+        sent = app["stats"]["requests"] - requests_before
+        hedges = sum(s.hedges for s in router.stats.values())
+        print(
+            f"{name:>22} | {percentile(latencies, 50) * 1000:>8.0f} | {percentile(latencies, 95) * 1000:>8.0f} | "
+            f"{percentile(latencies, 99) * 1000:>8.0f} | {answered:>4}/{count} | {sent / count - 1:>+7.0%} | "
+            f"{hedges:>5} | {' → '.join(router.chain())}"
+        )
+    finally:
+        await runner.cleanup()
+        await main.openrouter.close()
+
+
+async def bench(count, concurrency):
+    print(f"{'scénario':>22} | {'p50 (ms)':>8} | {'p95 (ms)':>8} | {'p99 (ms)':>8} | {'réponses':>8} | {'surcoût':>7} | {'couv.':>5} | chaîne")
+    tail = {"delay": BASE_DELAY, "tail_rate": TAIL_RATE, "tail_delay": TAIL_DELAY}
+    await scenario("queue, sans couverture", tail, False, count, concurrency)
+    await scenario("queue, avec couverture", tail, True, count, concurrency)
+    failing = dict(tail, model_error_rates={"principal": 1.0})
+    await scenario("principal en panne", failing, True, count, concurrency)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(bench(args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main_cli()
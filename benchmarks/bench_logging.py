@@ -0,0 +1,70 @@
+# Temps passé sur la boucle asyncio par message pour la journalisation :
+# anciens print(..., flush=True) synchrones contre la file de logging échantillonnée.
+# Deux destinations sont simulées pour stdout : un fichier local, et un pipe lu lentement
+# comme celui d'un collecteur de logs d'hébergeur (le cas où print bloque la boucle).
+#
+# Usage : python benchmarks/bench_logging.py
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+
+MESSAGES = 5000
+CONTENT = "t'es vraiment trop fort sur ce jeu, on se refait une partie ce soir ?"
+READER_DELAY = 0.05  # pause du lecteur lent entre deux lectures de 64 Ko (~1,3 Mo/s)
+
+
+def file_sink():
+    return open(os.devnull if os.name == "nt" else "/tmp/bench_logging.out", "w", encoding="utf-8")
+
+
+def slow_pipe_sink():
+    read_fd, write_fd = os.pipe()
+
+    def drain():
+        while os.read(read_fd, 65536):
+            time.sleep(READER_DELAY)
+
+    threading.Thread(target=drain, daemon=True).start()
+    return os.fdopen(write_fd, "w", encoding="utf-8")
+
+
+def with_print(out):
+    # Ce que faisait on_message : une ligne par message reçu et une par comparaison fuzzy
+    for i in range(MESSAGES):
+        print(f"on_message déclenché: membre#{i % 50} a envoyé: {CONTENT}", file=out, flush=True)
+        print(f"Comparaison: 'fils de pute' vs '{CONTENT}' -> score 42", file=out, flush=True)
+
+
+def with_logging(out):
+    for handler in main.log_listener.handlers:
+        handler.setStream(out)
+    for i in range(MESSAGES):
+        main.message_log.info("on_message déclenché: %s a envoyé: %s", f"membre#{i % 50}", CONTENT)
+        main.matcher_log.debug("Comparaison: '%s' vs '%s' -> score %s", "fils de pute", CONTENT, 42)
+
+
+def measure(fn, sink):
+    out = sink()
+    start = time.perf_counter()
+    fn(out)
+    return (time.perf_counter() - start) / MESSAGES * 1e6
+
+
+def run():
+    print(f"{'destination':>14} | {'print flush (µs/msg)':>20} | {'logging (µs/msg)':>16}")
+    for name, sink in (("fichier", file_sink), ("pipe lent", slow_pipe_sink)):
+        printed = measure(with_print, sink)
+        logged = measure(with_logging, sink)
+        print(f"{name:>14} | {printed:>20.2f} | {logged:>16.2f}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,75 @@
+# Microbenchmark du matcher de mots interdits.
+# Compare l'ancienne boucle (normalisation de toute la liste à chaque message)
+# au ForbiddenWordMatcher précompilé, pour des listes de 13 à 10 000 expressions.
+#
+# Usage : python benchmarks/bench_matcher.py
+import contextlib
+import io
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+
+from rapidfuzz import fuzz
+
+SIZES = [13, 100, 1000, 10000]
+MESSAGES = [
+    "salut tout le monde, quelqu'un chaud pour une partie ce soir ?",
+    "j'ai trop aimé l'épisode d'hier, le twist de fin était incroyable",
+    "t'es vraiment un fils de pute toi",
+    "GG à l'équipe, on a gagné 3 games d'affilée !!!",
+    "quelqu'un a vu mon message dans le salon général ?",
+] * 40
+
+
+def naive_contains(words, message_content):
+    normalized_msg = main.normalize_text(message_content)
+    msg_tokens = set(normalized_msg.split())
+    for forbidden in words:
+        normalized_forbidden = main.normalize_text(forbidden)
+        forb_tokens = set(normalized_forbidden.split())
+        if not forb_tokens.issubset(msg_tokens):
+            continue
+        score = fuzz.token_set_ratio(normalized_forbidden, normalized_msg)
+        if score >= main.FUZZY_THRESHOLD:
+            return True, forbidden, score
+    return False, None, None
+
+
+def synthetic_words(n, rng):
+    words = list(main.forbidden_words)
+    while len(words) < n:
+        length = rng.randint(1, 3)
+        words.append(" ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(length)))
+    return words[:n]
+
+
+def per_message_us(fn, messages):
+    start = time.perf_counter()
+    for msg in messages:
+        fn(msg)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+def run():
+    rng = random.Random(42)
+    print(f"{'expressions':>12} | {'boucle naïve (µs/msg)':>22} | {'matcher (µs/msg)':>17} | {'build (ms)':>10}")
+    for size in SIZES:
+        words = synthetic_words(size, rng)
+        start = time.perf_counter()
+        matcher = main.ForbiddenWordMatcher(words)
+        build_ms = (time.perf_counter() - start) * 1000
+        with contextlib.redirect_stdout(io.StringIO()):
+            naive = per_message_us(lambda m: naive_contains(words, m), MESSAGES)
+            compiled = per_message_us(matcher.match, MESSAGES)
+        print(f"{size:>12} | {naive:>22.1f} | {compiled:>17.1f} | {build_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    run()
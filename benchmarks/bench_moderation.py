@@ -0,0 +1,77 @@
+# Débit de la modération et retard de la boucle asyncio : exécution en ligne contre
+# pool de processus (MODERATION_WORKERS), sur une grande liste et des messages longs.
+#
+# Usage : python benchmarks/bench_moderation.py [--phrases 10000] [--messages 2000]
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+
+
+def build_corpus(phrase_count, message_count, rng):
+    vocabulary = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 8))) for _ in range(phrase_count)]
+    phrases = [" ".join(rng.sample(vocabulary, 2)) for _ in range(phrase_count)]
+    # Messages longs dont la moitié des mots sont des tokens de la liste : beaucoup de candidats
+    # à vérifier, quelques vraies détections
+    noise = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(5000)]
+    messages = [" ".join(rng.choices(vocabulary, k=60) + rng.choices(noise, k=60)) for _ in range(message_count)]
+    return phrases, messages
+
+
+async def lag_probe(samples, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - expected)
+
+
+async def measure(executor, messages):
+    lags = []
+    probe = asyncio.create_task(lag_probe(lags))
+    await asyncio.sleep(0.05)  # la sonde doit déjà être en attente quand la rafale arrive
+    started = time.perf_counter()
+    results = await asyncio.gather(*(executor.check(message) for message in messages))
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(0.05)  # laisse la sonde enregistrer le retard de la rafale
+    probe.cancel()
+    return len(messages) / elapsed, max(lags, default=0.0), sum(1 for detected, _, _ in results if detected)
+
+
+def run(args):
+    rng = random.Random(7)
+    phrases, messages = build_corpus(args.phrases, args.messages, rng)
+    main.forbidden_words[:] = phrases
+    main.forbidden_matcher = main.ForbiddenWordMatcher(phrases)
+    print(f"{len(phrases)} expressions, {len(messages)} messages de 120 mots, {os.cpu_count()} cœur(s)")
+    print(f"{'mode':>12} | {'messages/s':>10} | {'retard max boucle (ms)':>22} | {'détections':>10}")
+    modes = [0] + [n for n in (1, 2, 4, 8) if n <= max(1, os.cpu_count() or 1)]
+    for workers in modes:
+        executor = main.ModerationExecutor(workers, args.batch_size, 0.005)
+        executor.start()
+        if executor.pool is not None:
+            warmup = [executor.pool.submit(main._match_batch, executor.version, executor.words, ["warmup"]) for _ in range(workers)]
+            for future in warmup:
+                future.result()
+        rate, max_lag, hits = asyncio.run(measure(executor, messages))
+        executor.shutdown()
+        label = "en ligne" if workers == 0 else f"{workers} process"
+        print(f"{label:>12} | {rate:>10.0f} | {max_lag * 1000:>22.1f} | {hits:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Banc d'essai de la modération")
+    parser.add_argument("--phrases", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    run(parser.parse_args())
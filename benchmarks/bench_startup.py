@@ -0,0 +1,106 @@
+# Démarrage du serveur keep-alive : ancien serveur de développement Flask dans un thread
+# contre le serveur aiohttp sur la boucle du bot. Chaque mode tourne dans un processus neuf ;
+# on mesure le temps jusqu'à la première réponse 200 sur "/", puis la mémoire résidente
+# (VmRSS) et le nombre de threads du processus une fois le serveur prêt.
+#
+# Usage : python benchmarks/bench_startup.py [--runs 5]
+# (le mode flask nécessite `pip install flask`, il n'est plus dans requirements.txt)
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+CHILDREN = {
+    # Reproduit l'ancien keep_alive() : routes Flask dans un thread à côté de la boucle
+    "flask": """
+import main
+from threading import Thread
+from flask import Flask
+app = Flask('')
+
+@app.route('/')
+def home():
+    return "Je suis en ligne !"
+
+Thread(target=lambda: app.run(host='127.0.0.1', port=PORT), daemon=True).start()
+import time
+time.sleep(3600)
+""",
+    "aiohttp": """
+import asyncio
+import main
+
+async def serve():
+    await main.start_http_server(PORT)
+    await asyncio.sleep(3600)
+
+asyncio.run(serve())
+""",
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def proc_status(pid, field):
+    with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def run_once(mode, workdir):
+    port = free_port()
+    env = dict(os.environ, LOG_LEVEL="ERROR", DATABASE_FILE=os.path.join(workdir, f"{mode}.db"), CONVERSATION_BACKEND="memory")
+    code = CHILDREN[mode].replace("PORT", str(port))
+    started = time.perf_counter()
+    child = subprocess.Popen([sys.executable, "-c", code], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if child.poll() is not None:
+                raise RuntimeError(f"le processus {mode} s'est arrêté (code {child.returncode})")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        break
+            except OSError:
+                time.sleep(0.005)
+        elapsed = time.perf_counter() - started
+        time.sleep(0.2)  # laisse retomber les allocations du démarrage
+        return elapsed, proc_status(child.pid, "VmRSS"), proc_status(child.pid, "Threads")
+    finally:
+        child.kill()
+        child.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix="cringegpt-startup-")
+    print(f"{'mode':>8} | {'prêt (ms)':>10} | {'RSS (Mo)':>9} | {'threads':>7}")
+    for mode in CHILDREN:
+        try:
+            results = [run_once(mode, workdir) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{mode:>8} | {e}")
+            continue
+        ready = statistics.median(r[0] for r in results) * 1000
+        rss = statistics.median(r[1] for r in results) / 1024
+        threads = statistics.median(r[2] for r in results)
+        print(f"{mode:>8} | {ready:>10.0f} | {rss:>9.1f} | {threads:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
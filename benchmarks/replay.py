@@ -0,0 +1,231 @@
+# Banc d'essai hors ligne du traitement des messages : rejoue un corpus (enregistré ou
+# synthétique) dans on_message avec de faux objets Discord et le serveur OpenRouter factice,
+# sans connexion réseau. Rapporte le débit, les latences p50/p99 par étape et la mémoire.
+#
+# Usage : python benchmarks/replay.py [--messages 2000] [--corpus corpus.jsonl] [--rate 0] [--llm-delay 0.05]
+# (RESPONSE_CACHE=1 dans l'environnement pour mesurer le cache des réponses)
+# Format du corpus JSONL : {"author_id": 1, "guild_id": 2, "content": "...", "mention": true}
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+BOT_ID = 999
+ADMIN_CHANNEL_ID = 42
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+PORT = free_port()
+WORKDIR = tempfile.mkdtemp(prefix="cringegpt-replay-")
+os.environ.update({
+    "OPENROUTER_API_URL": f"http://127.0.0.1:{PORT}/api/v1/chat/completions",
+    "OPENROUTER_API_KEYS": "replay-key-1,replay-key-2",
+    "DATABASE_FILE": os.path.join(WORKDIR, "replay.db"),
+    "CONVERSATION_BACKEND": os.environ.get("CONVERSATION_BACKEND", "memory"),
+    "ADMIN_CHANNEL_ID": str(ADMIN_CHANNEL_ID),
+    "LOG_LEVEL": os.environ.get("LOG_LEVEL", "ERROR"),
+    # Le contrôle d'admission fausserait le débit mesuré : désactivé sauf demande explicite
+    "LLM_LIMIT_USER": os.environ.get("LLM_LIMIT_USER", "0"),
+    "LLM_LIMIT_CHANNEL": os.environ.get("LLM_LIMIT_CHANNEL", "0"),
+    "LLM_LIMIT_GUILD": os.environ.get("LLM_LIMIT_GUILD", "0"),
+})
+# La base des mots interdits est migrée depuis le JSON du dépôt
+os.chdir(os.path.join(HERE, ".."))
+
+import main  # noqa: E402
+import stub_openrouter  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+
+class FakeUser:
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.mention = f"<@{user_id}>"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMessage:
+    _next_id = 1
+
+    def __init__(self, content, author, channel, guild=None, mentions=()):
+        self.id = FakeMessage._next_id
+        FakeMessage._next_id += 1
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.mentions = list(mentions)
+        self.embeds = []
+        self.attachments = []
+
+    async def edit(self, content=None, embed=None, **kwargs):
+        if content is not None:
+            self.content = content
+        return self
+
+
+class FakeChannel:
+    def __init__(self, channel_id, guild=None):
+        self.id = channel_id
+        self.guild = guild
+        self.sent = 0
+
+    async def send(self, content=None, embed=None, **kwargs):
+        self.sent += 1
+        await asyncio.sleep(0)  # un envoi réel rend la main à la boucle
+        return FakeMessage(content or "", main.client.user, self, self.guild)
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.channels = {ADMIN_CHANNEL_ID: FakeChannel(ADMIN_CHANNEL_ID, self)}
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def channel(self, channel_id):
+        if channel_id not in self.channels:
+            self.channels[channel_id] = FakeChannel(channel_id, self)
+        return self.channels[channel_id]
+
+
+PROMPTS = [
+    "salut !", "t'es qui ?", "raconte moi une blague", "tu préfères les chats ou les chiens ?",
+    "c'est quoi le meilleur anime de la saison ?", "on fait quoi ce soir sur le serveur ?",
+]
+CHATTER = [
+    "gg la team", "quelqu'un pour une partie ?", "j'ai fini mes devoirs enfin",
+    "le boss final était trop dur", "vous avez vu le dernier épisode ?", "bonne nuit tout le monde",
+]
+BANNED = ["t'es qu'un fils de pute", "grosse salope va", "sale pd"]
+
+
+def synthetic_corpus(count, guilds, users, mention_rate, banned_rate, seed=1):
+    rng = random.Random(seed)
+    for _ in range(count):
+        roll = rng.random()
+        if roll < banned_rate:
+            content, mention = rng.choice(BANNED), False
+        elif roll < banned_rate + mention_rate:
+            content, mention = rng.choice(PROMPTS), True
+        else:
+            content, mention = rng.choice(CHATTER), False
+        yield {"author_id": rng.randrange(users) + 10_000, "guild_id": rng.randrange(guilds) + 1, "content": content, "mention": mention}
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def replay(entries, rate):
+    samples = {}
+    original_observe = main.pipeline_stage_seconds.observe
+
+    def record(value, **labels):
+        samples.setdefault(labels.get("stage"), []).append(value)
+        original_observe(value, **labels)
+
+    main.pipeline_stage_seconds.observe = record
+    bot_user = FakeUser(BOT_ID, "CringeGPT", bot=True)
+    main.client._connection.user = bot_user
+    guilds, users = {}, {}
+    messages = []
+    for entry in entries:
+        guild = guilds.setdefault(entry["guild_id"], FakeGuild(entry["guild_id"]))
+        author = users.setdefault(entry["author_id"], FakeUser(entry["author_id"], f"membre{entry['author_id']}"))
+        content = entry["content"]
+        mentions = []
+        if entry.get("mention"):
+            content = f"<@{BOT_ID}> {content}"
+            mentions = [bot_user]
+        messages.append(FakeMessage(content, author, guild.channel(100 + entry["guild_id"]), guild, mentions))
+
+    tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    tasks = []
+    for message in messages:
+        # Comme la gateway : chaque message est traité dans sa propre tâche
+        tasks.append(asyncio.create_task(main.on_message(message)))
+        if rate:
+            await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+    while main.conversation_scheduler.workers:
+        await asyncio.gather(*list(main.conversation_scheduler.workers.values()))
+    elapsed = time.perf_counter() - started
+    memory_after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    main.pipeline_stage_seconds.observe = original_observe
+    return len(messages), elapsed, samples, memory_after - memory_before
+
+
+async def run(args):
+    app = stub_openrouter.make_app(delay=args.llm_delay, chunk_delay=0.001)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    entries = list(load_corpus(args.corpus) if args.corpus else synthetic_corpus(
+        args.messages, args.guilds, args.users, args.mention_rate, args.banned_rate))
+    try:
+        count, elapsed, samples, memory_growth = await replay(entries, args.rate)
+    finally:
+        await main.openrouter.close()
+        await main.conversation_store.close()
+        await runner.cleanup()
+
+    print(f"messages rejoués     : {count} en {elapsed:.2f}s ({count / elapsed:.0f} messages/s)")
+    print(f"appels LLM           : {app['stats']['requests']} (mentions regroupées : {main.conversation_scheduler.coalesced})")
+    if main.response_cache is not None:
+        stats = main.response_cache.stats()
+        print(f"cache des réponses   : {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%}), {stats['latency_saved']:.2f}s de latence évitée")
+    print(f"mémoire allouée      : {memory_growth / 1024:+.0f} Ko (tracemalloc), RSS max {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} Mo")
+    print(f"{'étape':>10} | {'n':>6} | {'p50 (ms)':>9} | {'p99 (ms)':>9}")
+    for stage in ("normalize", "match", "history", "payload", "llm", "send"):
+        values = samples.get(stage, [])
+        if values:
+            print(f"{stage:>10} | {len(values):>6} | {percentile(values, 50) * 1000:>9.3f} | {percentile(values, 99) * 1000:>9.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rejoue un corpus de messages dans on_message")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--corpus", help="fichier JSONL enregistré (sinon corpus synthétique)")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--mention-rate", type=float, default=0.2)
+    parser.add_argument("--banned-rate", type=float, default=0.02)
+    parser.add_argument("--rate", type=float, default=0, help="messages par seconde (0 = rafale)")
+    parser.add_argument("--llm-delay", type=float, default=0.05, help="latence simulée d'OpenRouter")
+    asyncio.run(run(parser.parse_args()))
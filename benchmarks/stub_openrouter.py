@@ -0,0 +1,106 @@
+# Serveur HTTP local qui imite l'API chat/completions d'OpenRouter, pour tester
+# le client du bot sans réseau. Pointer le bot dessus avec
+# OPENROUTER_API_URL=http://127.0.0.1:8089/api/v1/chat/completions
+#
+# Comportements simulés :
+#   - clés commençant par "ratelimited" : 429 avec Retry-After
+#   - --delay / --model-delay modele=secondes : réponses lentes
+#   - "stream": true dans le payload : réponse SSE fragment par fragment
+#   - --error-rate / --model-error modele=proportion : proportion de 500 aléatoires
+#   - --tail-rate / --tail-delay : une requête sur N reçoit un délai supplémentaire (latence de queue)
+#
+# Usage : python benchmarks/stub_openrouter.py --port 8089 --delay 0.2 --model-delay openai/gpt-4o=2
+import argparse
+import asyncio
+import json
+import random
+
+from aiohttp import web
+
+REPLY = "Kyaaa~ coucou senpai ! Je suis la réponse du serveur de test 🚀💖"
+
+
+def make_app(delay=0.0, model_delays=None, error_rate=0.0, chunk_delay=0.02, retry_after=5, reply=REPLY,
+             model_error_rates=None, tail_rate=0.0, tail_delay=0.0):
+    model_delays = model_delays or {}
+    model_error_rates = model_error_rates or {}
+    stats = {"requests": 0, "rate_limited": 0, "errors": 0, "streams": 0, "models": {}}
+
+    async def completions(request):
+        stats["requests"] += 1
+        key = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        payload = await request.json()
+        if key.startswith("ratelimited"):
+            stats["rate_limited"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit exceeded", "code": 429}},
+                status=429,
+                headers={"Retry-After": str(retry_after), "X-RateLimit-Remaining": "0"},
+            )
+        model = payload.get("model")
+        stats["models"][model] = stats["models"].get(model, 0) + 1
+        wait = model_delays.get(model, delay)
+        if random.random() < tail_rate:
+            wait += tail_delay
+        await asyncio.sleep(wait)
+        if random.random() < model_error_rates.get(model, error_rate):
+            stats["errors"] += 1
+            return web.json_response({"error": {"message": "Internal error", "code": 500}}, status=500)
+        usage = {"prompt_tokens": sum(len(m.get("content", "")) // 4 for m in payload.get("messages", [])), "completion_tokens": len(reply) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if not payload.get("stream"):
+            return web.json_response({
+                "id": "stub",
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+        stats["streams"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(b": OPENROUTER PROCESSING\n\n")
+        for word in reply.split(" "):
+            chunk = {"choices": [{"index": 0, "delta": {"content": word + " "}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(chunk_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_post("/api/v1/chat/completions", completions)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+def parse_model_delays(values):
+    delays = {}
+    for value in values or []:
+        model, _, seconds = value.partition("=")
+        delays[model] = float(seconds)
+    return delays
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serveur OpenRouter factice")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--model-delay", action="append", help="modele=secondes")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--chunk-delay", type=float, default=0.02)
+    parser.add_argument("--model-error", action="append", help="modele=proportion")
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-delay", type=float, default=0.0)
+    args = parser.parse_args()
+    web.run_app(
+        make_app(
+            args.delay, parse_model_delays(args.model_delay), args.error_rate, args.chunk_delay,
+            model_error_rates=parse_model_delays(args.model_error), tail_rate=args.tail_rate, tail_delay=args.tail_delay,
+        ),
+        host="127.0.0.1",
+        port=args.port,
+    )